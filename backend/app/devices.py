@@ -0,0 +1,235 @@
+"""Memory-bounded in-memory device state.
+
+Each device is a `DeviceState` record with `__slots__` and a fixed-size
+counts array (one slot per gender filter, in `GENDERS` order) instead of a
+dict of dicts. Daily counts are stamped with an integer epoch day and roll
+over lazily, with no DB write, on the first access after local midnight.
+The store keeps at most `DEVICE_STORE_CAPACITY` records in LRU order and
+evicts idle ones; an evicted device is rehydrated from the `Device` /
+`DailyLimit` tables the next time it connects.
+"""
+import asyncio
+import datetime
+import os
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from sqlalchemy import select
+
+from .database import AsyncSessionLocal
+from .models import Device, DailyLimit
+
+DEVICE_STORE_CAPACITY = int(os.getenv("DEVICE_STORE_CAPACITY", "100000"))
+DEVICE_IDLE_SECONDS = float(os.getenv("DEVICE_IDLE_SECONDS", "3600"))
+DEVICE_SWEEP_INTERVAL = float(os.getenv("DEVICE_SWEEP_INTERVAL", "60"))
+DAILY_FILTER_LIMIT = int(os.getenv("DAILY_FILTER_LIMIT", "5"))
+RECENT_PARTNERS = int(os.getenv("RECENT_PARTNERS", "8"))
+
+# Index order of DeviceState.counts
+GENDERS = ("male", "female", "non-binary", "prefer-not-to-say")
+GENDER_INDEX = {g: i for i, g in enumerate(GENDERS)}
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+# Cached local day and its [start, end) timestamps
+_day = 0
+_day_start = 0.0
+_day_end = 0.0
+
+
+def current_day(now: Optional[float] = None) -> int:
+    """Local epoch day (days since 1970-01-01); recomputed only when the cached day ends"""
+    global _day, _day_start, _day_end
+    t = time.time() if now is None else now
+    if _day_start <= t < _day_end:
+        return _day
+    d = datetime.date.fromtimestamp(t)
+    if now is not None:
+        return d.toordinal() - _EPOCH_ORDINAL
+    _day = d.toordinal() - _EPOCH_ORDINAL
+    _day_start = time.mktime(d.timetuple())
+    _day_end = time.mktime((d + datetime.timedelta(days=1)).timetuple())
+    return _day
+
+
+def day_iso(day: int) -> str:
+    """YYYY-MM-DD for an epoch day, as stored in DailyLimit.date"""
+    return datetime.date.fromordinal(day + _EPOCH_ORDINAL).isoformat()
+
+
+class DeviceState:
+    """Per-device state kept in memory"""
+    __slots__ = (
+        "gender", "nickname", "last_join", "last_seen", "day", "counts", "rate_start", "rate_count",
+        "recent", "recent_pos", "hydrated",
+    )
+
+    def __init__(self):
+        self.gender: Optional[str] = None
+        self.nickname: Optional[str] = None
+        self.last_join = 0.0
+        self.last_seen = time.monotonic()
+        self.day = 0  # epoch day the counts belong to
+        self.counts = array("H", bytes(2 * len(GENDERS)))
+        self.rate_start = 0.0
+        self.rate_count = 0
+        self.recent: Optional[array] = None  # ring of recent partner keys, allocated on first match
+        self.recent_pos = 0
+        self.hydrated = False  # gender / today's counts loaded from the DB
+
+    def roll(self, day: int):
+        """Start a fresh set of counts if `day` is newer than the stored one"""
+        if self.day != day:
+            self.day = day
+            counts = self.counts
+            for i in range(len(counts)):
+                counts[i] = 0
+
+    def remaining(self, index: int, limit: int = DAILY_FILTER_LIMIT) -> int:
+        """Matches left today for the filter at `index` (call `roll` first)"""
+        left = limit - self.counts[index]
+        return left if left > 0 else 0
+
+    def remember(self, partner: int):
+        """Record a partner key in the recent-partner ring (oldest overwritten)"""
+        if RECENT_PARTNERS <= 0:
+            return
+        if self.recent is None:
+            self.recent = array("I", bytes(4 * RECENT_PARTNERS))
+        self.recent[self.recent_pos] = partner
+        self.recent_pos = (self.recent_pos + 1) % RECENT_PARTNERS
+
+    def has_met(self, partner: int) -> bool:
+        """True if `partner` is among the last RECENT_PARTNERS partners"""
+        return self.recent is not None and partner in self.recent
+
+
+class DeviceStore:
+    """LRU-ordered DeviceState records with a capacity and idle eviction.
+
+    `pinned(device_id)` reports devices that must stay resident (connected,
+    queued or paired); they are skipped by eviction, so capacity is soft.
+    """
+
+    def __init__(
+        self,
+        pinned: Callable[[str], bool] = lambda device_id: False,
+        capacity: int = DEVICE_STORE_CAPACITY,
+        idle_seconds: float = DEVICE_IDLE_SECONDS,
+        sweep_interval: float = DEVICE_SWEEP_INTERVAL,
+    ):
+        self.pinned = pinned
+        self.capacity = capacity
+        self.idle_seconds = idle_seconds
+        self.sweep_interval = sweep_interval
+        self._states: "OrderedDict[str, DeviceState]" = OrderedDict()
+        self.evicted = 0
+        self.rehydrated = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._states
+
+    def get(self, device_id: str) -> Optional[DeviceState]:
+        """Return the state for a device (marking it recently used), or None"""
+        state = self._states.get(device_id)
+        if state is not None:
+            state.last_seen = time.monotonic()
+            self._states.move_to_end(device_id)
+        return state
+
+    def ensure(self, device_id: str) -> DeviceState:
+        """Return the state for a device, creating it if needed"""
+        state = self.get(device_id)
+        if state is None:
+            state = self._states[device_id] = DeviceState()
+            if len(self._states) > self.capacity:
+                self._evict_lru()
+        return state
+
+    def _evict_lru(self):
+        # Walk from the least recently used end, skipping pinned devices
+        for _ in range(min(len(self._states), 64)):
+            if len(self._states) <= self.capacity:
+                return
+            device_id = next(iter(self._states))
+            if self.pinned(device_id):
+                self._states.move_to_end(device_id)
+                continue
+            del self._states[device_id]
+            self.evicted += 1
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """Evict unpinned devices idle for longer than `idle_seconds`"""
+        cutoff = (time.monotonic() if now is None else now) - self.idle_seconds
+        stale = []
+        for device_id, state in self._states.items():
+            if state.last_seen >= cutoff:
+                break  # LRU order: everything after this was seen more recently
+            if not self.pinned(device_id):
+                stale.append(device_id)
+        for device_id in stale:
+            del self._states[device_id]
+        self.evicted += len(stale)
+        return len(stale)
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            n = self.evict_idle()
+            if n:
+                print(f"[DEVICES] Evicted {n} idle devices ({len(self)} resident)")
+
+    async def rehydrate(self, device_id: str, today: int) -> DeviceState:
+        """Return the state for a device, loading gender and today's counts from the DB once per residency.
+
+        Tracked with `hydrated` rather than residency: `/verify` creates the
+        record before the device connects, and that must not hide its counts.
+        """
+        state = self.ensure(device_id)
+        if state.hydrated:
+            return state
+        try:
+            async with AsyncSessionLocal() as session:
+                q = await session.execute(select(Device.gender).where(Device.device_id == device_id))
+                state.gender = state.gender or q.scalars().first()
+                q = await session.execute(
+                    select(DailyLimit).where((DailyLimit.device_id == device_id) & (DailyLimit.date == day_iso(today)))
+                )
+                row = q.scalars().first()
+                if row:
+                    state.roll(today)
+                    stored = (row.male_count, row.female_count, row.non_binary_count, row.prefer_not_to_say_count)
+                    for i, n in enumerate(stored):
+                        # Never lower a count already taken in memory
+                        state.counts[i] = max(state.counts[i], n or 0)
+            state.hydrated = True
+            self.rehydrated += 1
+        except Exception as e:
+            print(f"[DEVICES] ⚠️ Could not rehydrate {device_id}: {e}")
+        return state
+
+    def stats(self) -> dict:
+        return {
+            "resident": len(self),
+            "capacity": self.capacity,
+            "evicted": self.evicted,
+            "rehydrated": self.rehydrated,
+        }
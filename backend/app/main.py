@@ -4,7 +4,16 @@ from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
 from .database import AsyncSessionLocal, engine, Base, DATABASE_URL
 from .models import Device, Report, DailyLimit
+from .resume import ResumeRegistry, RESUMABLE_CLOSE_CODES
+from .moderation import ReportTracker, ModerationWorker
+from .overload import LagMonitor, AdmissionControl, VerifyAdmissionMiddleware, WS_CLOSE_TRY_AGAIN
+from .profiling import Profiler, ProfilingMiddleware
+from .trace import TraceRecorder, CONNECT, DISCONNECT, VERIFY, RESUMED, SHED
+from .devices import DeviceStore, DeviceState, GENDERS, GENDER_INDEX, current_day, day_iso
+from .matching import pick_partner, relax_deadline, partner_key
 from fastapi.middleware.cors import CORSMiddleware
+from typing import Optional
+from urllib.parse import parse_qs
 import hashlib
 import asyncio
 import time
@@ -17,15 +26,6 @@ import datetime
 
 app = FastAPI()
 
-origins = ["http://localhost:5173", "http://localhost:3000"]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 
 @app.on_event("startup")
 async def startup_create_tables():
@@ -57,14 +57,45 @@ async def root():
     return {"message": "Anonymous Chat backend running.", "docs": "/docs"}
 
 # In-memory device store and queues for MVP/demo
-devices = {}  # device_id -> {gender, nickname, bio, last_join, daily_counts}
+devices = DeviceStore(lambda d: d in ws_connections or d in active_pairs)  # device_id -> DeviceState (bounded, LRU)
 banned_devices = {}  # device_id -> {reason, timestamp, ban_type} (ban_type: "temporary" or "permanent")
-report_count = {}  # device_id -> number of reports received
-request_count = {}  # device_id -> {count, timestamp} for rate limiting (60 per minute)
-queues = {"male": [], "female": [], "non-binary": [], "prefer-not-to-say": [], "any": []}  # lists of (device_id, websocket)
+report_tracker = ReportTracker()  # device_id -> distinct reporters in the sliding report window
+queues = {"male": [], "female": [], "non-binary": [], "prefer-not-to-say": [], "any": []}  # waiter's filter -> [(device_id, websocket, enqueued_at)]
 active_pairs = {}  # device_id -> peer_device_id
 ws_connections = {}  # device_id -> websocket
+resume_sessions = ResumeRegistry()  # resume tokens + pairs held across brief disconnects
+loop_lag = LagMonitor()  # event-loop lag sampler
+admission = AdmissionControl(loop_lag)  # connection caps + load shedding for /ws and /verify
+profiler = Profiler()  # opt-in timers + cProfile captures, see /admin/profiling
+tracer = TraceRecorder()  # optional anonymized traffic trace (TRACE_PATH) for replay_trace.py
+rematch_tasks = {}  # device_id -> task re-running matching once a skipped recent partner is eligible
 lock = asyncio.Lock()
+WS_ACTIONS = {"join", "leave", "msg", "typing", "next", "report"}
+
+
+def trace_verify(scope: dict, admitted: bool):
+    """Record a /verify attempt, shed or not, before its body is read"""
+    if not tracer.enabled:
+        return
+    device_id = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("device_id", [""])[0]
+    length = dict(scope.get("headers", ())).get(b"content-length", b"0")
+    size_kb = int(length) // 1024 if length.isdigit() else 0
+    tracer.record(VERIFY, device_id, arg=min(size_kb, SHED - 1) | (0 if admitted else SHED))
+
+
+# Last added runs first: CORS wraps the /verify gate, which wraps the profiling timers,
+# so shed 503s still carry CORS headers
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+app.add_middleware(VerifyAdmissionMiddleware, admission=admission, observe=trace_verify)
+
+origins = ["http://localhost:5173", "http://localhost:3000"]
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 
 def classify_gender_from_image(image_bytes: bytes) -> str:
@@ -105,8 +136,7 @@ def classify_gender_from_image(image_bytes: bytes) -> str:
     return result
 
 
-@app.post("/verify")
-async def verify(device_id: str = Query(...), file: UploadFile = File(...)):
+async def verify_device(device_id: str, file: UploadFile):
     """
     PRODUCTION-GRADE Gender verification endpoint.
     - Validates image format and size
@@ -141,7 +171,8 @@ async def verify(device_id: str = Query(...), file: UploadFile = File(...)):
     # ===== GENDER DETECTION (STRICT) =====
     try:
         print(f"[VERIFY] Processing gender detection for {device_id}")
-        gender = classify_gender_from_image(content)
+        with profiler.section("verify.classify"):
+            gender = classify_gender_from_image(content)
         
         if not gender or gender not in ['male', 'female', 'non-binary', 'prefer-not-to-say']:
             print(f"[VERIFY] Invalid gender result: {gender}")
@@ -156,24 +187,24 @@ async def verify(device_id: str = Query(...), file: UploadFile = File(...)):
         del content
 
     # ===== UPDATE IN-MEMORY STATE =====
-    devices.setdefault(device_id, {})["gender"] = gender
-    devices[device_id].setdefault("limits", {})
+    devices.ensure(device_id).gender = gender
 
     # ===== PERSIST TO DATABASE (NON-BLOCKING) =====
     try:
-        async with AsyncSessionLocal() as session:
-            q = await session.execute(select(Device).where(Device.device_id == device_id))
-            d = q.scalars().first()
-            if d:
-                d.gender = gender
-                d.created_at = d.created_at or datetime.datetime.utcnow()
-                print(f"[DB] Updated device {device_id} gender to {gender}")
-            else:
-                d = Device(device_id=device_id, gender=gender, created_at=datetime.datetime.utcnow())
-                session.add(d)
-                print(f"[DB] Created new device {device_id} with gender {gender}")
-            await session.commit()
-            print(f"[DB] ✅ Successfully verified and saved device {device_id}")
+        with profiler.section("db.verify"):
+            async with AsyncSessionLocal() as session:
+                q = await session.execute(select(Device).where(Device.device_id == device_id))
+                d = q.scalars().first()
+                if d:
+                    d.gender = gender
+                    d.created_at = d.created_at or datetime.datetime.utcnow()
+                    print(f"[DB] Updated device {device_id} gender to {gender}")
+                else:
+                    d = Device(device_id=device_id, gender=gender, created_at=datetime.datetime.utcnow())
+                    session.add(d)
+                    print(f"[DB] Created new device {device_id} with gender {gender}")
+                await session.commit()
+                print(f"[DB] ✅ Successfully verified and saved device {device_id}")
     except SQLAlchemyError as db_err:
         print(f"[DB ERROR] SQLAlchemy error: {db_err}")
         raise HTTPException(status_code=500, detail="Database error during verification")
@@ -189,23 +220,74 @@ async def verify(device_id: str = Query(...), file: UploadFile = File(...)):
     }
 
 
+@app.post("/verify")
+async def verify(device_id: str = Query(...), file: UploadFile = File(...)):
+    """Gender verification (shed with 503 + Retry-After by VerifyAdmissionMiddleware while overloaded)"""
+    return await verify_device(device_id, file)
+
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, device_id: str = Query(...)):
+async def websocket_endpoint(websocket: WebSocket, device_id: str = Query(...), resume_token: Optional[str] = Query(None)):
     # Check if device is banned
     if is_device_banned(device_id):
         ban_info = banned_devices.get(device_id, {})
         await websocket.close(code=4000, reason=f"Device banned: {ban_info.get('reason', 'Unknown')}")
         return
-    
+
+    # Admission control: refuse new chats while overloaded, keep serving existing ones
+    # (including reconnects that carry a valid resume token)
+    client = websocket.client.host if websocket.client else "unknown"
+    resuming = resume_sessions.check(device_id, resume_token)
+    admitted, reason = admission.admit_ws(client, resuming)
+    if tracer.enabled:
+        # Refused attempts are recorded too, so a trace of a spike keeps the load that caused it
+        tracer.record(CONNECT, device_id, arg=(RESUMED if resume_token else 0) | (0 if admitted else SHED))
+    if not admitted:
+        await websocket.accept()
+        await websocket.close(code=WS_CLOSE_TRY_AGAIN, reason=f"{reason}; retry after {admission.retry_after}s")
+        return
+    try:
+        await serve_websocket(websocket, device_id, resuming)
+    finally:
+        admission.release_ws(client)
+        if tracer.enabled:
+            tracer.record(DISCONNECT, device_id)
+
+
+async def serve_websocket(websocket: WebSocket, device_id: str, resuming: bool):
     await websocket.accept()
+    missed = []
+    if resuming:
+        held = resume_sessions.resume(device_id)
+        if held:
+            missed = list(held.buffer)
+        # The old socket may not have been noticed as dead yet; point its queue entries here
+        await swap_queued_websocket(device_id, websocket)
+    elif resume_sessions.cancel(device_id):
+        # A fresh connection ends any pair still held for this device
+        await remove_from_queues(device_id)
     ws_connections[device_id] = websocket
     try:
+        # Load gender / today's counts from the DB if this device was evicted
+        await devices.rehydrate(device_id, current_day())
+        await websocket.send_json({"type": "session", "resume_token": resume_sessions.issue(device_id)})
+        if resuming:
+            peer = active_pairs.get(device_id)
+            await websocket.send_json({"type": "resumed", "peer": peer, "missed": len(missed)})
+            for frame in missed:
+                await websocket.send_json(frame)
+            if peer:
+                await relay_message(peer, {"type": "peer_resumed", "peer": device_id})
+            print(f"[RESUME] {device_id} resumed (peer={peer}, missed={len(missed)})")
+
         # Send initial daily limits to client
         limits = get_remaining_limits(device_id)
         await websocket.send_json({"type": "daily_limits", "limits": limits})
         
         while True:
             data = await websocket.receive_json()
+            if tracer.enabled:
+                tracer.record_action(device_id, data)
             
             # Rate limiting check
             if not check_rate_limit(device_id):
@@ -213,215 +295,230 @@ async def websocket_endpoint(websocket: WebSocket, device_id: str = Query(...)):
                 continue
             
             action = data.get("action")
-            if action == "join":
-                filter_pref = data.get("filter", "any")
-                nickname = data.get("nickname")
-                devices.setdefault(device_id, {})["nickname"] = nickname
-                # reset daily counts if needed
-                reset_daily_counts_if_needed(device_id)
-                now = time.time()
-                last = devices[device_id].get("last_join", 0)
-                if now - last < 5:
-                    await websocket.send_json({"type": "error", "message": "Cooldown: wait before re-joining"})
-                    continue
-                devices[device_id]["last_join"] = now
-                await add_to_queue(device_id, websocket, filter_pref)
-            elif action == "leave":
-                await remove_from_queues(device_id)
-            elif action == "msg":
-                msg_text = data.get("text", "").strip()
-                # Validate message
-                if not msg_text or len(msg_text) > 500:
-                    await websocket.send_json({"type": "error", "message": "Invalid message"})
-                    continue
-                peer = active_pairs.get(device_id)
-                if peer:
-                    # Relay message to peer if connected
-                    await relay_message(peer, {"type": "msg", "from": device_id, "text": msg_text})
-            elif action == "typing":
-                peer = active_pairs.get(device_id)
-                if peer:
-                    # Send typing indicator to peer
-                    await relay_message(peer, {"type": "typing", "from": device_id})
-            elif action == "next":
-                # leave current pair and re-queue
-                await remove_from_queues(device_id)
-                await websocket.send_json({"type": "left"})
-            elif action == "report":
-                reported = data.get("reported")
-                reason = data.get("reason", "Inappropriate behavior")
-                
-                # Increment report count
-                report_count[reported] = report_count.get(reported, 0) + 1
-                
-                # Auto-ban after 3 reports
-                if report_count[reported] >= 3:
-                    ban_device(reported, f"Auto-banned after 3 reports: {reason}", "temporary")
-                    # If reported user is connected, notify them
-                    if reported in ws_connections:
-                        try:
-                            await ws_connections[reported].send_json({
-                                "type": "error",
-                                "message": "You have been temporarily banned due to multiple reports. Ban expires in 24 hours."
-                            })
-                        except Exception:
-                            pass
-                
-                # persist report (best-effort)
-                try:
-                    async with AsyncSessionLocal() as session:
-                        r = Report(reporter_device_id=device_id, reported_device_id=reported, reason=reason)
-                        session.add(r)
-                        await session.commit()
-                except Exception:
-                    pass
-                await websocket.send_json({"type": "reported", "target": reported})
-    except WebSocketDisconnect:
-        await remove_from_queues(device_id)
-        ws_connections.pop(device_id, None)
+            # Per-action timers (only when profiling is enabled)
+            started = profiler.start() if profiler.enabled else None
+            try:
+                if action == "join":
+                    filter_pref = data.get("filter", "any")
+                    nickname = data.get("nickname")
+                    state = devices.ensure(device_id)
+                    state.nickname = nickname
+                    now = time.time()
+                    if now - state.last_join < 5:
+                        await websocket.send_json({"type": "error", "message": "Cooldown: wait before re-joining"})
+                        continue
+                    state.last_join = now
+                    with profiler.section("add_to_queue"):
+                        await add_to_queue(device_id, websocket, filter_pref)
+                elif action == "leave":
+                    await remove_from_queues(device_id)
+                elif action == "msg":
+                    msg_text = data.get("text", "").strip()
+                    # Validate message
+                    if not msg_text or len(msg_text) > 500:
+                        await websocket.send_json({"type": "error", "message": "Invalid message"})
+                        continue
+                    peer = active_pairs.get(device_id)
+                    if peer:
+                        # Relay message to peer if connected
+                        await relay_message(peer, {"type": "msg", "from": device_id, "text": msg_text})
+                elif action == "typing":
+                    peer = active_pairs.get(device_id)
+                    if peer:
+                        # Send typing indicator to peer
+                        await relay_message(peer, {"type": "typing", "from": device_id})
+                elif action == "next":
+                    # leave current pair and re-queue
+                    await remove_from_queues(device_id)
+                    await websocket.send_json({"type": "left"})
+                elif action == "report":
+                    reported = data.get("reported")
+                    reason = data.get("reason", "Inappropriate behavior")
+                    # Counting, persistence and ban decisions run in the moderation worker
+                    moderation.submit(device_id, reported, reason)
+                    await websocket.send_json({"type": "reported", "target": reported})
+            finally:
+                if started:
+                    # isinstance first: unhashable actions (e.g. a list) must not raise here
+                    name = action if isinstance(action, str) and action in WS_ACTIONS else "other"
+                    profiler.stop(f"ws.{name}", started)
+    except WebSocketDisconnect as exc:
+        await handle_disconnect(device_id, websocket, exc.code)
+
+
+async def handle_disconnect(device_id: str, websocket: WebSocket, code: int = 1000):
+    """Hold an active pair for the resume grace window after a network drop; tear it down on a clean close"""
+    if ws_connections.get(device_id) is not websocket:
+        # Superseded by a newer (resumed) connection for the same device
+        return
+    ws_connections.pop(device_id, None)
+    peer = active_pairs.get(device_id)
+    if peer and resume_sessions.enabled and code in RESUMABLE_CLOSE_CODES:
+        resume_sessions.hold(device_id, peer, remove_from_queues)
+        await relay_message(peer, {"type": "peer_away", "peer": device_id})
+        print(f"[RESUME] Holding pair {device_id} <-> {peer} for {resume_sessions.grace}s")
+        return
+    resume_sessions.forget(device_id)
+    await remove_from_queues(device_id)
+
+
+async def swap_queued_websocket(device_id: str, websocket: WebSocket):
+    """Point any queue entries for a device at its new websocket"""
+    async with lock:
+        for k in queues:
+            queues[k] = [(d, websocket if d == device_id else w, t) for (d, w, t) in queues[k]]
 
 
 async def add_to_queue(device_id: str, websocket: WebSocket, filter_pref: str):
     async with lock:
-        # Try to find a match from other queues honoring filter
-        # Simple policy: match with first compatible waiting client
-        for target_filter, lst in queues.items():
-            for idx, (other_id, other_ws) in enumerate(lst):
-                if other_id == device_id:
-                    continue
-                # check compatibility: each user's stored gender should satisfy other's filter
-                other_gender = devices.get(other_id, {}).get("gender")
-                my_gender = devices.get(device_id, {}).get("gender")
-                
-                # If filter_pref is specific, ensure other_gender matches
-                if filter_pref != "any" and other_gender != filter_pref:
-                    continue
-                
-                # enforce per-device daily limits for using specific filters
-                reset_daily_counts_if_needed(device_id)
-                reset_daily_counts_if_needed(other_id)
-                limit = 5
-                
-                # if user requested a specific filter, count it as a specific match
-                if filter_pref in ("male", "female", "non-binary", "prefer-not-to-say"):
-                    if devices[device_id].get("daily_counts", {}).get(filter_pref, 0) >= limit:
-                        # reject this join attempt
-                        await websocket.send_json({"type": "error", "message": "Daily limit reached for this filter"})
-                        return
-                
-                # Also ensure that other's filter allows my_gender (we don't store other's filter in this simple demo)
-                # Pair them
-                lst.pop(idx)
-                active_pairs[device_id] = other_id
-                active_pairs[other_id] = device_id
-                
-                # increment daily counts
-                for gend in ("male", "female", "non-binary", "prefer-not-to-say"):
-                    if my_gender == gend:
-                        devices[device_id].setdefault("daily_counts", {"date": today_iso(), "male": 0, "female": 0, "non-binary": 0, "prefer-not-to-say": 0})
-                        if filter_pref in ("male", "female", "non-binary", "prefer-not-to-say"):
-                            devices[device_id]["daily_counts"][filter_pref] += 1
-                            # Sync to DB
-                            counts = devices[device_id]["daily_counts"]
-                            asyncio.create_task(sync_daily_limits_to_db(
-                                device_id, counts['date'],
-                                counts['male'], counts['female'], 
-                                counts['non-binary'], counts['prefer-not-to-say']
-                            ))
-                    if other_gender == gend:
-                        devices[other_id].setdefault("daily_counts", {"date": today_iso(), "male": 0, "female": 0, "non-binary": 0, "prefer-not-to-say": 0})
-                        devices[other_id]["daily_counts"][other_gender] += 1
-                        # Sync to DB
-                        counts = devices[other_id]["daily_counts"]
-                        asyncio.create_task(sync_daily_limits_to_db(
-                            other_id, counts['date'],
-                            counts['male'], counts['female'],
-                            counts['non-binary'], counts['prefer-not-to-say']
-                        ))
-                
-                print(f"[MATCH] {device_id} matched with {other_id}")
-                print(f"[LIMITS] {device_id}: {devices[device_id]['daily_counts']}")
-                print(f"[LIMITS] {other_id}: {devices[other_id]['daily_counts']}")
-                
-                # Prepare peer profiles to send
-                my_profile = {
-                    "nickname": devices.get(device_id, {}).get("nickname", "Anon"),
-                    "gender": my_gender or "?",
-                }
-                other_profile = {
-                    "nickname": devices.get(other_id, {}).get("nickname", "Anon"),
-                    "gender": other_gender or "?",
-                }
-                
-                # notify both with peer profile
-                limits = get_remaining_limits(device_id)
-                await websocket.send_json({
-                    "type": "matched",
-                    "peer": other_id,
-                    "peer_profile": other_profile,
-                    "peer_gender": other_gender,
-                    "limits": limits,
-                })
-                try:
-                    other_limits = get_remaining_limits(other_id)
-                    await other_ws.send_json({
-                        "type": "matched",
-                        "peer": device_id,
-                        "peer_profile": my_profile,
-                        "peer_gender": my_gender,
-                        "limits": other_limits,
-                    })
-                except Exception:
-                    pass
-                return
+        today = current_day()
+        me = devices.ensure(device_id)
+        me.roll(today)
+        
+        if filter_pref not in queues:
+            await websocket.send_json({"type": "error", "message": "Invalid filter"})
+            return
+        
+        # enforce per-device daily limits for using specific filters
+        if filter_pref in GENDER_INDEX and not me.remaining(GENDER_INDEX[filter_pref]):
+            # reject this join attempt
+            await websocket.send_json({"type": "error", "message": "Daily limit reached for this filter"})
+            return
+        
+        # Pair with the longest-waiting waiter compatible in both directions,
+        # skipping recent partners (see app/matching.py)
+        now = time.time()
+        found = pick_partner(queues, device_id, me, filter_pref, devices.get, now)
+        if found:
+            await pair_devices(device_id, websocket, filter_pref, *found)
+            return
         
         # No match yet; add to chosen queue
-        queues.setdefault(filter_pref, []).append((device_id, websocket))
+        queues[filter_pref].append((device_id, websocket, now))
+        schedule_rematch(device_id, me, filter_pref, now)
         limits = get_remaining_limits(device_id)
         await websocket.send_json({"type": "queued", "filter": filter_pref, "limits": limits})
 
 
+async def pair_devices(device_id: str, websocket: WebSocket, filter_pref: str, other_filter: str, idx: int):
+    """Pair `device_id` with the waiter at `queues[other_filter][idx]` and notify both (call under lock)"""
+    today = current_day()
+    me = devices.ensure(device_id)
+    me.roll(today)
+    my_gender = me.gender
+    other_id, other_ws, _ = queues[other_filter].pop(idx)
+    other = devices.ensure(other_id)
+    other.roll(today)
+    other_gender = other.gender
+    active_pairs[device_id] = other_id
+    active_pairs[other_id] = device_id
+    
+    # increment daily counts for each side that used a specific filter
+    if filter_pref in GENDER_INDEX:
+        me.counts[GENDER_INDEX[filter_pref]] += 1
+        # Sync to DB
+        asyncio.create_task(sync_daily_limits_to_db(device_id, day_iso(today), *me.counts))
+    if other_filter in GENDER_INDEX:
+        other.counts[GENDER_INDEX[other_filter]] += 1
+        # Sync to DB
+        asyncio.create_task(sync_daily_limits_to_db(other_id, day_iso(today), *other.counts))
+    me.remember(partner_key(other_id))
+    other.remember(partner_key(device_id))
+    
+    print(f"[MATCH] {device_id} matched with {other_id}")
+    
+    # Prepare peer profiles to send
+    my_profile = {
+        "nickname": me.nickname or "Anon",
+        "gender": my_gender or "?",
+    }
+    other_profile = {
+        "nickname": other.nickname or "Anon",
+        "gender": other_gender or "?",
+    }
+    
+    # notify both with peer profile
+    limits = get_remaining_limits(device_id)
+    await websocket.send_json({
+        "type": "matched",
+        "peer": other_id,
+        "peer_profile": other_profile,
+        "peer_gender": other_gender,
+        "limits": limits,
+    })
+    try:
+        other_limits = get_remaining_limits(other_id)
+        await other_ws.send_json({
+            "type": "matched",
+            "peer": device_id,
+            "peer_profile": my_profile,
+            "peer_gender": my_gender,
+            "limits": other_limits,
+        })
+    except Exception:
+        pass
+
+
+def schedule_rematch(device_id: str, me: DeviceState, filter_pref: str, now: float):
+    """Re-run matching for a queued device when a recent partner it skipped becomes eligible.
+
+    Matching otherwise only runs on join, so two recent partners left alone in
+    the queues would wait forever (call under lock).
+    """
+    retry_at = relax_deadline(queues, device_id, me, filter_pref, devices.get)
+    if retry_at is None:
+        return
+    task = rematch_tasks.pop(device_id, None)
+    if task is not None:
+        task.cancel()
+    rematch_tasks[device_id] = asyncio.create_task(rematch_later(device_id, retry_at - now))
+
+
+async def rematch_later(device_id: str, delay: float):
+    await asyncio.sleep(max(0.0, delay))
+    rematch_tasks.pop(device_id, None)
+    async with lock:
+        for filter_pref, entries in queues.items():
+            idx = next((i for i, e in enumerate(entries) if e[0] == device_id), None)
+            if idx is not None:
+                break
+        else:
+            return  # matched, left or disconnected meanwhile
+        me = devices.get(device_id)
+        if me is None:
+            return
+        # Take the entry out so pick_partner doesn't see the device as its own waiter
+        entry = entries.pop(idx)
+        now = time.time()
+        found = pick_partner(queues, device_id, me, filter_pref, devices.get, now)
+        if not found:
+            entries.insert(idx, entry)
+            schedule_rematch(device_id, me, filter_pref, now)
+            return
+        try:
+            await pair_devices(device_id, entry[1], filter_pref, *found)
+        except Exception as e:
+            print(f"[MATCH ERROR] Re-match for {device_id} failed: {e}")
+
+
 async def remove_from_queues(device_id: str):
     async with lock:
         for k in list(queues.keys()):
-            queues[k] = [(d, w) for (d, w) in queues[k] if d != device_id]
+            queues[k] = [e for e in queues[k] if e[0] != device_id]
         peer = active_pairs.pop(device_id, None)
         if peer:
             active_pairs.pop(peer, None)
-            # notify peer if connected
-            ws = ws_connections.get(peer)
-            if ws:
-                try:
-                    await ws.send_json({"type": "peer_left", "peer": device_id})
-                except Exception:
-                    pass
-
-
-def today_iso():
-    return time.strftime('%Y-%m-%d')
+            # notify peer if connected (buffered if the peer is inside its resume window)
+            resume_sessions.detach_peer(peer)
+            await relay_message(peer, {"type": "peer_left", "peer": device_id})
 
 
 def get_remaining_limits(device_id: str) -> dict:
-    """Return remaining matches for each filter (5 max per filter) - DB backed"""
-    # First try to read from DB
-    try:
-        import asyncio
-        # Sync context for this function - can't use async here directly
-        # So we'll use in-memory cache as primary, DB as backup
-        reset_daily_counts_if_needed(device_id)
-        counts = devices.get(device_id, {}).get('daily_counts', {})
-        
-        remaining = {
-            'male': max(0, 5 - counts.get('male', 0)),
-            'female': max(0, 5 - counts.get('female', 0)),
-            'non-binary': max(0, 5 - counts.get('non-binary', 0)),
-            'prefer-not-to-say': max(0, 5 - counts.get('prefer-not-to-say', 0)),
-        }
-        print(f"[LIMITS] {device_id}: {remaining}")
-        return remaining
-    except Exception as e:
-        print(f"[LIMITS ERROR] {e}")
-        return {'male': 5, 'female': 5, 'non-binary': 5, 'prefer-not-to-say': 5}
+    """Return remaining matches for each filter (DAILY_FILTER_LIMIT per filter) for client payloads"""
+    with profiler.section("get_remaining_limits"):
+        state = devices.ensure(device_id)
+        state.roll(current_day())
+        return {g: state.remaining(i) for i, g in enumerate(GENDERS)}
 
 
 def is_device_banned(device_id: str) -> bool:
@@ -440,7 +537,7 @@ def is_device_banned(device_id: str) -> bool:
         else:
             # Ban expired, remove it
             del banned_devices[device_id]
-            report_count[device_id] = 0
+            report_tracker.clear(device_id)
             return False
     return False
 
@@ -454,89 +551,142 @@ def ban_device(device_id: str, reason: str = "Multiple reports", ban_type: str =
     }
     # Remove from all queues
     for k in queues:
-        queues[k] = [(d, w) for (d, w) in queues[k] if d != device_id]
+        queues[k] = [e for e in queues[k] if e[0] != device_id]
     # Remove from active pairs
     if device_id in active_pairs:
         peer = active_pairs.pop(device_id)
         active_pairs.pop(peer, None)
 
 
+async def auto_ban(device_id: str, reason: str):
+    """Temporarily ban a device that crossed the report threshold and notify it"""
+    if is_device_banned(device_id):
+        return
+    ban_device(device_id, reason, "temporary")
+    print(f"[MOD] {device_id} {reason}")
+    # If reported user is connected, notify them
+    if device_id in ws_connections:
+        try:
+            await ws_connections[device_id].send_json({
+                "type": "error",
+                "message": "You have been temporarily banned due to multiple reports. Ban expires in 24 hours."
+            })
+        except Exception:
+            pass
+
+
+async def persist_report(reporter: str, reported: str, reason: str):
+    """Persist a report (best-effort)"""
+    try:
+        with profiler.section("db.report"):
+            async with AsyncSessionLocal() as session:
+                r = Report(reporter_device_id=reporter, reported_device_id=reported, reason=reason)
+                session.add(r)
+                await session.commit()
+    except Exception:
+        pass
+
+
+moderation = ModerationWorker(report_tracker, auto_ban, persist_report)
+
+
+@app.on_event("startup")
+async def startup_moderation():
+    moderation.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_moderation():
+    await moderation.stop()
+
+
+@app.on_event("startup")
+async def startup_trace():
+    tracer.open()
+
+
+@app.on_event("shutdown")
+async def shutdown_trace():
+    tracer.close()
+
+
+@app.on_event("startup")
+async def startup_device_sweeper():
+    devices.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_device_sweeper():
+    await devices.stop()
+
+
+@app.on_event("startup")
+async def startup_lag_monitor():
+    loop_lag.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_lag_monitor():
+    await loop_lag.stop()
+
+
 def check_rate_limit(device_id: str, limit: int = 60) -> bool:
     """Check if device has exceeded rate limit (60 requests per minute)"""
     now = time.time()
-    if device_id not in request_count:
-        request_count[device_id] = {'count': 1, 'timestamp': now}
-        return True
-    
-    count_info = request_count[device_id]
-    elapsed = now - count_info['timestamp']
+    state = devices.ensure(device_id)
+    elapsed = now - state.rate_start
     
     if elapsed >= 60:  # Reset every minute
-        request_count[device_id] = {'count': 1, 'timestamp': now}
+        state.rate_start = now
+        state.rate_count = 1
         return True
     else:
-        if count_info['count'] >= limit:
+        if state.rate_count >= limit:
             return False  # Rate limited
-        count_info['count'] += 1
+        state.rate_count += 1
         return True
 
 
-def reset_daily_counts_if_needed(device_id: str):
-    """Reset daily counts if date changed - ensure DB sync"""
-    d = devices.setdefault(device_id, {})
-    dc = d.get('daily_counts')
-    t = today_iso()
-    
-    if not dc or dc.get('date') != t:
-        # New day - reset counters
-        d['daily_counts'] = {'date': t, 'male': 0, 'female': 0, 'non-binary': 0, 'prefer-not-to-say': 0}
-        print(f"[RESET] {device_id} daily counts for {t}")
-        
-        # Also sync to DB in background (non-blocking)
-        try:
-            import asyncio
-            asyncio.create_task(sync_daily_limits_to_db(device_id, t, 0, 0, 0, 0))
-        except:
-            pass
-
-
 async def sync_daily_limits_to_db(device_id: str, date: str, male: int, female: int, non_binary: int, prefer_not_to_say: int):
     """Sync daily limit counts to database"""
     try:
         from .models import DailyLimit
-        async with AsyncSessionLocal() as session:
-            # Check if record exists
-            q = await session.execute(
-                select(DailyLimit).where(
-                    (DailyLimit.device_id == device_id) & (DailyLimit.date == date)
+        with profiler.section("db.daily_limits"):
+            async with AsyncSessionLocal() as session:
+                # Check if record exists
+                q = await session.execute(
+                    select(DailyLimit).where(
+                        (DailyLimit.device_id == device_id) & (DailyLimit.date == date)
+                    )
                 )
-            )
-            limit_record = q.scalars().first()
+                limit_record = q.scalars().first()
             
-            if limit_record:
-                limit_record.male_count = male
-                limit_record.female_count = female
-                limit_record.non_binary_count = non_binary
-                limit_record.prefer_not_to_say_count = prefer_not_to_say
-                print(f"[DB] Updated daily limits for {device_id} on {date}")
-            else:
-                limit_record = DailyLimit(
-                    device_id=device_id,
-                    date=date,
-                    male_count=male,
-                    female_count=female,
-                    non_binary_count=non_binary,
-                    prefer_not_to_say_count=prefer_not_to_say
-                )
-                session.add(limit_record)
-                print(f"[DB] Created daily limits for {device_id} on {date}")
+                if limit_record:
+                    limit_record.male_count = male
+                    limit_record.female_count = female
+                    limit_record.non_binary_count = non_binary
+                    limit_record.prefer_not_to_say_count = prefer_not_to_say
+                    print(f"[DB] Updated daily limits for {device_id} on {date}")
+                else:
+                    limit_record = DailyLimit(
+                        device_id=device_id,
+                        date=date,
+                        male_count=male,
+                        female_count=female,
+                        non_binary_count=non_binary,
+                        prefer_not_to_say_count=prefer_not_to_say
+                    )
+                    session.add(limit_record)
+                    print(f"[DB] Created daily limits for {device_id} on {date}")
             
-            await session.commit()
+                await session.commit()
     except Exception as e:
         print(f"[DB ERROR] Failed to sync daily limits: {e}")
 
 
 async def relay_message(peer_device_id: str, payload: dict):
+    if resume_sessions.buffer(peer_device_id, payload):
+        return
     ws = ws_connections.get(peer_device_id)
     if ws:
         try:
@@ -565,6 +715,44 @@ async def list_reports(limit: int = 50):
         raise HTTPException(status_code=500, detail="Failed to read reports")
 
 
+@app.get("/admin/profiling")
+async def profiling_stats():
+    """Per-action / per-endpoint timers and capture status"""
+    return profiler.stats()
+
+
+@app.post("/admin/profiling")
+async def profiling_toggle(enabled: bool = Query(...), reset: bool = False):
+    """Turn the profiling timers on or off at runtime"""
+    profiler.enabled = enabled
+    if reset:
+        profiler.reset()
+    print(f"[PROFILE] Timers {'enabled' if enabled else 'disabled'}")
+    return profiler.stats()
+
+
+@app.post("/admin/profiling/capture")
+async def profiling_capture(seconds: float = 10):
+    """Run a time-boxed cProfile capture of the event loop and dump it to a local file"""
+    try:
+        path = profiler.capture(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"capturing": True, "path": path}
+
+
+@app.get("/admin/devices")
+async def device_store_stats():
+    """Resident / evicted / rehydrated counts for the in-memory device store"""
+    return devices.stats()
+
+
+@app.get("/admin/overload")
+async def overload_stats():
+    """Event-loop lag, open connections and shed counts"""
+    return admission.stats()
+
+
 if __name__ == "__main__":
     # Allow running the FastAPI app directly for development:
     # `python -m app.main` will start a Uvicorn server.
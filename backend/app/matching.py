@@ -0,0 +1,97 @@
+"""Partner selection for the matchmaking queues.
+
+Queues map a waiter's own filter ("any" or a gender) to a list of
+`(device_id, websocket, enqueued_at)` entries in arrival order. A joining
+device is paired with the longest-waiting waiter that is compatible in both
+directions (each side's gender satisfies the other's filter) and that is not
+one of its recent partners. Recent-partner exclusion is waived for waiters
+that have been queued for `MATCH_RELAX_SECONDS`. Matching only runs when a
+device joins, so when a join skips a waiter only for being a recent partner,
+the caller re-runs matching at `relax_deadline` (otherwise two recent
+partners alone in the queues would never be paired).
+"""
+import os
+import zlib
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .devices import DeviceState, GENDER_INDEX
+
+MATCH_SCAN_LIMIT = int(os.getenv("MATCH_SCAN_LIMIT", "64"))
+MATCH_RELAX_SECONDS = float(os.getenv("MATCH_RELAX_SECONDS", "15"))
+
+
+def partner_key(device_id: str) -> int:
+    """Non-zero 32-bit key for the recent-partner rings"""
+    return zlib.crc32(device_id.encode()) or 1
+
+
+def accepts(filter_pref: str, gender: Optional[str]) -> bool:
+    return filter_pref == "any" or filter_pref == gender
+
+
+def pick_partner(
+    queues: Dict[str, List[tuple]],
+    device_id: str,
+    me: DeviceState,
+    filter_pref: str,
+    lookup: Callable[[str], Optional[DeviceState]],
+    now: float,
+    scan_limit: int = MATCH_SCAN_LIMIT,
+    relax_seconds: float = MATCH_RELAX_SECONDS,
+) -> Optional[Tuple[str, int]]:
+    """Return `(queue_key, index)` of the best waiter for `device_id`, or None.
+
+    Only queues whose filter accepts my gender are scanned, at most
+    `scan_limit` entries each, so the cost per join is bounded.
+    """
+    my_key = partner_key(device_id)
+    keys = ("any", me.gender) if me.gender in GENDER_INDEX else ("any",)
+    best = None
+    best_at = float("inf")
+    for key in keys:
+        for idx, (other_id, _ws, enqueued_at) in enumerate(islice(queues.get(key, ()), scan_limit)):
+            if enqueued_at >= best_at:
+                break  # arrival order: nothing later in this queue has waited longer
+            if other_id == device_id:
+                continue
+            other = lookup(other_id)
+            if other is None or not accepts(filter_pref, other.gender):
+                continue
+            # Same expression as relax_deadline, so a re-match at that deadline always qualifies
+            if now < enqueued_at + relax_seconds and (me.has_met(partner_key(other_id)) or other.has_met(my_key)):
+                continue
+            best = (key, idx)
+            best_at = enqueued_at
+            break
+    return best
+
+
+def relax_deadline(
+    queues: Dict[str, List[tuple]],
+    device_id: str,
+    me: DeviceState,
+    filter_pref: str,
+    lookup: Callable[[str], Optional[DeviceState]],
+    scan_limit: int = MATCH_SCAN_LIMIT,
+    relax_seconds: float = MATCH_RELAX_SECONDS,
+) -> Optional[float]:
+    """When `pick_partner` found nobody: the earliest time a compatible waiter,
+    skipped only because it is a recent partner, becomes eligible (or None)."""
+    my_key = partner_key(device_id)
+    keys = ("any", me.gender) if me.gender in GENDER_INDEX else ("any",)
+    deadline = None
+    for key in keys:
+        for other_id, _ws, enqueued_at in islice(queues.get(key, ()), scan_limit):
+            if other_id == device_id:
+                continue
+            other = lookup(other_id)
+            if other is None or not accepts(filter_pref, other.gender):
+                continue
+            if me.has_met(partner_key(other_id)) or other.has_met(my_key):
+                # Arrival order: the first one in this queue is the earliest to relax
+                at = enqueued_at + relax_seconds
+                if deadline is None or at < deadline:
+                    deadline = at
+                break
+    return deadline
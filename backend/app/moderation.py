@@ -0,0 +1,151 @@
+"""Report tracking and background moderation.
+
+Reports are counted per target as distinct reporters inside a sliding time
+window of `REPORT_BUCKETS` time buckets, kept as one compact array of
+(reporter, bucket) pairs per target. The WebSocket loop only enqueues
+reports; a background worker records them, persists them and decides bans
+so none of that work runs on the reporter's hot path.
+"""
+import asyncio
+import os
+import time
+import zlib
+from array import array
+from typing import Awaitable, Callable, Dict, Optional
+
+REPORT_WINDOW_SECONDS = int(os.getenv("REPORT_WINDOW_SECONDS", "86400"))
+REPORT_BUCKETS = int(os.getenv("REPORT_BUCKETS", "24"))
+REPORT_BAN_THRESHOLD = int(os.getenv("REPORT_BAN_THRESHOLD", "3"))
+REPORT_QUEUE_SIZE = int(os.getenv("REPORT_QUEUE_SIZE", "10000"))
+
+
+def reporter_key(device_id: str) -> int:
+    """32-bit key for a reporter; collisions only matter within one target's window"""
+    return zlib.crc32(device_id.encode())
+
+
+def _live(entries: array, oldest: int) -> int:
+    """Drop expired (reporter, bucket) pairs in place and return how many remain"""
+    i = 0
+    while i < len(entries):
+        if entries[i + 1] < oldest:
+            # Expired entry: swap in the last pair
+            entries[i], entries[i + 1] = entries[-2], entries[-1]
+            del entries[-2:]
+        else:
+            i += 2
+    return len(entries) // 2
+
+
+class ReportTracker:
+    """Sliding-window distinct-reporter counts for every reported device.
+
+    Each target maps to one `array("I")` of interleaved (reporter key, bucket)
+    pairs, one per distinct reporter still inside the window, so the count is
+    simply the number of live pairs.
+    """
+
+    def __init__(self, window: int = REPORT_WINDOW_SECONDS, buckets: int = REPORT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_seconds = max(1, window // buckets)
+        self.windows: Dict[str, array] = {}
+
+    def _bucket(self, now: Optional[float] = None) -> int:
+        return int((time.time() if now is None else now) // self.bucket_seconds)
+
+    def record(self, reporter: str, target: str, now: Optional[float] = None) -> int:
+        """Record a report and return the target's distinct-reporter count, or 0 if ignored"""
+        if not target or reporter == target:
+            return 0
+        bucket = self._bucket(now)
+        entries = self.windows.get(target)
+        if entries is None:
+            entries = self.windows[target] = array("I")
+        count = _live(entries, bucket - self.buckets + 1)
+        key = reporter_key(reporter)
+        for i in range(0, len(entries), 2):
+            if entries[i] == key:
+                return 0  # this reporter is already counted inside the window
+        entries.extend((key, bucket))
+        return count + 1
+
+    def count(self, target: str, now: Optional[float] = None) -> int:
+        entries = self.windows.get(target)
+        if not entries:
+            return 0
+        oldest = self._bucket(now) - self.buckets + 1
+        return sum(1 for i in range(1, len(entries), 2) if entries[i] >= oldest)
+
+    def clear(self, target: str):
+        self.windows.pop(target, None)
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Drop targets with no reports left in the window. Returns the number dropped."""
+        oldest = self._bucket(now) - self.buckets + 1
+        stale = [t for t, entries in self.windows.items() if not _live(entries, oldest)]
+        for t in stale:
+            del self.windows[t]
+        return len(stale)
+
+
+class ModerationWorker:
+    """Background consumer of reports that evaluates bans off the WebSocket loop"""
+
+    def __init__(
+        self,
+        tracker: ReportTracker,
+        on_ban: Callable[[str, str], Awaitable[None]],
+        persist: Callable[[str, str, str], Awaitable[None]],
+        threshold: int = REPORT_BAN_THRESHOLD,
+        maxsize: int = REPORT_QUEUE_SIZE,
+    ):
+        self.tracker = tracker
+        self.on_ban = on_ban
+        self.persist = persist
+        self.threshold = threshold
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+
+    def submit(self, reporter: str, target: str, reason: str) -> bool:
+        """Enqueue a report without blocking. Returns False if the queue is full."""
+        try:
+            self.queue.put_nowait((reporter, target, reason, time.time()))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"[MOD] ⚠️ Report queue full, dropped report on {target}")
+            return False
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        last_prune = time.time()
+        while True:
+            reporter, target, reason, ts = await self.queue.get()
+            try:
+                await self.handle(reporter, target, reason, ts)
+            except Exception as e:
+                print(f"[MOD ERROR] {e}")
+            finally:
+                self.queue.task_done()
+            if ts - last_prune >= self.tracker.bucket_seconds:
+                self.tracker.prune(ts)
+                last_prune = ts
+
+    async def handle(self, reporter: str, target: str, reason: str, ts: float):
+        count = self.tracker.record(reporter, target, ts)
+        await self.persist(reporter, target, reason)
+        if count >= self.threshold:
+            await self.on_ban(target, f"Auto-banned after {count} reports: {reason}")
@@ -0,0 +1,195 @@
+"""Overload protection: event-loop lag sampling and admission control.
+
+A background task measures how late the event loop wakes up from a short
+sleep. When that lag, or the number of open WebSockets, crosses the
+configured limits, new `/ws` connections are refused with a retry hint and
+`/verify` requests are shed. Connections that are already open, and clients
+resuming an existing chat with a valid resume token, are untouched.
+"""
+import asyncio
+import os
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from starlette.responses import JSONResponse
+
+MAX_WS_CONNECTIONS = int(os.getenv("MAX_WS_CONNECTIONS", "10000"))
+MAX_WS_PER_CLIENT = int(os.getenv("MAX_WS_PER_CLIENT", "0"))  # 0 disables; see README before enabling behind a proxy/NAT
+MAX_VERIFY_INFLIGHT = int(os.getenv("MAX_VERIFY_INFLIGHT", "16"))
+LAG_SHED_MS = float(os.getenv("LAG_SHED_MS", "200"))
+LAG_SAMPLE_INTERVAL = float(os.getenv("LAG_SAMPLE_INTERVAL", "0.5"))
+SHED_RETRY_AFTER = int(os.getenv("SHED_RETRY_AFTER", "5"))
+
+# WebSocket close code 1013: "Try Again Later"
+WS_CLOSE_TRY_AGAIN = 1013
+
+
+class LagMonitor:
+    """Samples event-loop lag as the overshoot of a fixed sleep"""
+
+    def __init__(self, interval: float = LAG_SAMPLE_INTERVAL, alpha: float = 0.3):
+        self.interval = interval
+        self.alpha = alpha
+        self.last_ms = 0.0
+        self.ewma_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.observe((time.perf_counter() - start - self.interval) * 1000)
+
+    def observe(self, lag_ms: float):
+        lag_ms = max(0.0, lag_ms)
+        self.last_ms = lag_ms
+        self.ewma_ms = lag_ms if not self.samples else self.alpha * lag_ms + (1 - self.alpha) * self.ewma_ms
+        self.max_ms = max(self.max_ms, lag_ms)
+        self.samples += 1
+
+
+class AdmissionControl:
+    """Connection caps and lag-based shedding for `/ws` and `/verify`"""
+
+    def __init__(
+        self,
+        lag: LagMonitor,
+        max_connections: int = MAX_WS_CONNECTIONS,
+        max_per_client: int = MAX_WS_PER_CLIENT,
+        max_verify: int = MAX_VERIFY_INFLIGHT,
+        lag_shed_ms: float = LAG_SHED_MS,
+        retry_after: int = SHED_RETRY_AFTER,
+    ):
+        self.lag = lag
+        self.max_connections = max_connections
+        self.max_per_client = max_per_client
+        self.max_verify = max_verify
+        self.lag_shed_ms = lag_shed_ms
+        self.retry_after = retry_after
+        self.connections = 0
+        self.per_client: Dict[str, int] = {}
+        self.verify_inflight = 0
+        self.shed = {"ws_lag": 0, "ws_global": 0, "ws_client": 0, "verify_busy": 0, "verify_inflight": 0}
+
+    def lagging(self) -> bool:
+        return self.lag_shed_ms > 0 and self.lag.ewma_ms >= self.lag_shed_ms
+
+    def admit_ws(self, client: str, resuming: bool = False) -> Tuple[bool, str]:
+        """Reserve a WebSocket slot for `client`. Returns (admitted, reason).
+
+        Resuming connections belong to an existing chat, so they skip lag and
+        global-cap shedding; only the per-client cap applies to them.
+        """
+        if not resuming and self.lagging():
+            self.shed["ws_lag"] += 1
+            return False, "Server busy"
+        if not resuming and self.connections >= self.max_connections:
+            self.shed["ws_global"] += 1
+            return False, "Too many connections"
+        if self.max_per_client > 0:
+            if self.per_client.get(client, 0) >= self.max_per_client:
+                self.shed["ws_client"] += 1
+                return False, "Too many connections from this client"
+            self.per_client[client] = self.per_client.get(client, 0) + 1
+        self.connections += 1
+        return True, ""
+
+    def release_ws(self, client: str):
+        self.connections -= 1
+        if self.max_per_client <= 0:
+            return
+        n = self.per_client.get(client, 0) - 1
+        if n > 0:
+            self.per_client[client] = n
+        else:
+            self.per_client.pop(client, None)
+
+    def admit_verify(self) -> bool:
+        """Reserve a `/verify` slot. Returns False if the request should be shed."""
+        if self.lagging() or self.connections >= self.max_connections:
+            self.shed["verify_busy"] += 1
+            return False
+        if self.verify_inflight >= self.max_verify:
+            self.shed["verify_inflight"] += 1
+            return False
+        self.verify_inflight += 1
+        return True
+
+    def release_verify(self):
+        self.verify_inflight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "lag_ms": {
+                "last": round(self.lag.last_ms, 2),
+                "ewma": round(self.lag.ewma_ms, 2),
+                "max": round(self.lag.max_ms, 2),
+                "samples": self.lag.samples,
+            },
+            "shedding": self.lagging(),
+            "connections": self.connections,
+            "clients": len(self.per_client),
+            "verify_inflight": self.verify_inflight,
+            "shed": dict(self.shed),
+            "limits": {
+                "max_connections": self.max_connections,
+                "max_per_client": self.max_per_client,
+                "max_verify_inflight": self.max_verify,
+                "lag_shed_ms": self.lag_shed_ms,
+            },
+        }
+
+
+class VerifyAdmissionMiddleware:
+    """Plain ASGI gate that sheds `POST /verify` before the upload is read.
+
+    Shedding inside the endpoint would only happen after FastAPI has read and
+    parsed the multipart body (up to 10MB), so the check runs here instead.
+    """
+
+    def __init__(
+        self,
+        app,
+        admission: AdmissionControl,
+        path: str = "/verify",
+        observe: Optional[Callable[[dict, bool], None]] = None,
+    ):
+        self.app = app
+        self.admission = admission
+        self.path = path
+        self.observe = observe  # called with (scope, admitted) for every attempt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+        admitted = self.admission.admit_verify()
+        if self.observe is not None:
+            self.observe(scope, admitted)
+        if not admitted:
+            response = JSONResponse(
+                {"detail": "Server busy, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(self.admission.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release_verify()
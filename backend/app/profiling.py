@@ -0,0 +1,152 @@
+"""Opt-in runtime profiling.
+
+Per-action wall/CPU timers for the WebSocket dispatch and HTTP endpoints,
+plus time-boxed cProfile captures written to a local file. Everything is off
+by default and toggled through the `/admin/profiling` endpoints; when off,
+each hook costs a single attribute check.
+
+CPU time is `time.thread_time()`. The event loop runs on one thread, so for
+actions that await it also includes other coroutines that ran meanwhile.
+"""
+import asyncio
+import cProfile
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "anonchat-profiles"))
+MAX_CAPTURE_SECONDS = 120
+
+
+class _NullSection:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+
+
+class _Section:
+    __slots__ = ("profiler", "name", "started")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.started = self.profiler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.stop(self.name, self.started)
+        return False
+
+
+class Profiler:
+    """Aggregated timers keyed by name: [count, wall_total, cpu_total, wall_max]"""
+
+    def __init__(self, enabled: bool = PROFILING_ENABLED, profile_dir: str = PROFILE_DIR):
+        self.enabled = enabled
+        self.profile_dir = profile_dir
+        self.timers: Dict[str, List[float]] = {}
+        self.since = time.time()
+        self.capture_task: Optional[asyncio.Task] = None
+        self.capture_path: Optional[str] = None
+
+    def start(self):
+        return time.perf_counter(), time.thread_time()
+
+    def stop(self, name: str, started):
+        wall = time.perf_counter() - started[0]
+        cpu = time.thread_time() - started[1]
+        t = self.timers.get(name)
+        if t is None:
+            self.timers[name] = [1, wall, cpu, wall]
+            return
+        t[0] += 1
+        t[1] += wall
+        t[2] += cpu
+        if wall > t[3]:
+            t[3] = wall
+
+    def section(self, name: str):
+        """Context manager timing a block; a shared no-op while profiling is off"""
+        return _Section(self, name) if self.enabled else _NULL_SECTION
+
+    def reset(self):
+        self.timers = {}
+        self.since = time.time()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "since": self.since,
+            "capturing": self.capturing,
+            "last_capture": self.capture_path,
+            "timers": {
+                name: {
+                    "count": int(count),
+                    "wall_ms_avg": round(wall / count * 1000, 3),
+                    "cpu_ms_avg": round(cpu / count * 1000, 3),
+                    "wall_ms_max": round(wall_max * 1000, 3),
+                    "wall_ms_total": round(wall * 1000, 3),
+                }
+                for name, (count, wall, cpu, wall_max) in sorted(self.timers.items())
+            },
+        }
+
+    @property
+    def capturing(self) -> bool:
+        return self.capture_task is not None and not self.capture_task.done()
+
+    def capture(self, seconds: float) -> str:
+        """Start a cProfile capture of the event loop thread; returns the dump path"""
+        if self.capturing:
+            raise RuntimeError("A capture is already running")
+        seconds = max(1.0, min(float(seconds), MAX_CAPTURE_SECONDS))
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"profile-{int(time.time())}.prof")
+        self.capture_path = path
+        self.capture_task = asyncio.create_task(self._capture(seconds, path))
+        return path
+
+    async def _capture(self, seconds: float, path: str):
+        prof = cProfile.Profile()
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+            prof.dump_stats(path)
+            print(f"[PROFILE] ✅ Wrote {seconds:.0f}s capture to {path}")
+
+
+class ProfilingMiddleware:
+    """Plain ASGI middleware timing HTTP requests per route template.
+
+    While profiling is off it forwards `scope`/`receive`/`send` untouched, so
+    the only per-request cost is the flag check.
+    """
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.enabled:
+            await self.app(scope, receive, send)
+            return
+        started = self.profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Key by route template so unmatched/parameterised paths can't grow the table
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.profiler.stop(f"http.{scope['method']} {route}", started)
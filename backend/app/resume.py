@@ -0,0 +1,115 @@
+"""Session resume tokens for brief WebSocket reconnects.
+
+When a paired device drops abnormally (e.g. a mobile network blip) its pair
+is held for a short grace window instead of being torn down; a clean close
+ends the pair right away. Frames addressed to the missing side are kept in a small ring buffer and replayed when the device
+reconnects to `/ws` with the `resume_token` it was issued.
+"""
+import asyncio
+import hmac
+import os
+import secrets
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+RESUME_GRACE_SECONDS = float(os.getenv("RESUME_GRACE_SECONDS", "20"))
+RESUME_BUFFER_SIZE = int(os.getenv("RESUME_BUFFER_SIZE", "32"))
+
+# Frames that are only meaningful live and are not worth replaying
+TRANSIENT_TYPES = {"typing"}
+
+# Close codes treated as a network drop (1006: closed without a close frame).
+# Clean closes (1000 normal, 1001 tab closed / navigated away, 1005 no status)
+# end the pair immediately.
+RESUMABLE_CLOSE_CODES = {1006}
+
+
+class HeldSession:
+    """A disconnected device whose pair is kept alive during the grace window"""
+    __slots__ = ("device_id", "peer", "expires_at", "buffer", "expiry_task")
+
+    def __init__(self, device_id: str, peer: Optional[str], grace: float, size: int):
+        self.device_id = device_id
+        self.peer = peer
+        self.expires_at = time.time() + grace
+        self.buffer = deque(maxlen=size)
+        self.expiry_task: Optional[asyncio.Task] = None
+
+
+class ResumeRegistry:
+    """Issues resume tokens and tracks held sessions"""
+
+    def __init__(self, grace: float = RESUME_GRACE_SECONDS, buffer_size: int = RESUME_BUFFER_SIZE):
+        self.grace = grace
+        self.buffer_size = buffer_size
+        self.tokens: Dict[str, str] = {}  # device_id -> current resume token
+        self.held: Dict[str, HeldSession] = {}  # device_id -> held session
+
+    @property
+    def enabled(self) -> bool:
+        return self.grace > 0
+
+    def issue(self, device_id: str) -> str:
+        """Issue a fresh token for a device, invalidating the previous one"""
+        token = secrets.token_urlsafe(16)
+        self.tokens[device_id] = token
+        return token
+
+    def check(self, device_id: str, token: Optional[str]) -> bool:
+        """Return True if `token` is the current token for `device_id`"""
+        expected = self.tokens.get(device_id)
+        if not token or not expected:
+            return False
+        return hmac.compare_digest(expected, token)
+
+    def is_held(self, device_id: str) -> bool:
+        return device_id in self.held
+
+    def hold(self, device_id: str, peer: str, on_expire: Callable[[str], Awaitable[None]]) -> HeldSession:
+        """Hold a disconnected device's pair and schedule teardown after the grace window"""
+        self.cancel(device_id)
+        session = HeldSession(device_id, peer, self.grace, self.buffer_size)
+        self.held[device_id] = session
+        session.expiry_task = asyncio.create_task(self._expire_later(session, on_expire))
+        return session
+
+    async def _expire_later(self, session: HeldSession, on_expire: Callable[[str], Awaitable[None]]):
+        await asyncio.sleep(max(0.0, session.expires_at - time.time()))
+        if self.held.get(session.device_id) is not session:
+            return
+        del self.held[session.device_id]
+        self.tokens.pop(session.device_id, None)
+        print(f"[RESUME] Grace window expired for {session.device_id}")
+        await on_expire(session.device_id)
+
+    def buffer(self, device_id: str, payload: dict) -> bool:
+        """Buffer a frame for a held device. Returns True if the device is held."""
+        session = self.held.get(device_id)
+        if session is None:
+            return False
+        if payload.get("type") not in TRANSIENT_TYPES:
+            session.buffer.append(payload)
+        return True
+
+    def detach_peer(self, device_id: str):
+        """Mark a held device as no longer paired (its peer left during the grace window)"""
+        session = self.held.get(device_id)
+        if session is not None:
+            session.peer = None
+
+    def resume(self, device_id: str) -> Optional[HeldSession]:
+        """Reattach a held device, returning its session with the missed frames"""
+        session = self.held.pop(device_id, None)
+        if session is not None and session.expiry_task is not None:
+            session.expiry_task.cancel()
+        return session
+
+    def cancel(self, device_id: str) -> Optional[HeldSession]:
+        """Drop a held session without running its teardown"""
+        return self.resume(device_id)
+
+    def forget(self, device_id: str):
+        """Drop all resume state for a device"""
+        self.cancel(device_id)
+        self.tokens.pop(device_id, None)
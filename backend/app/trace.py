@@ -0,0 +1,134 @@
+"""Traffic trace recording for deterministic replay (see `replay_trace.py`).
+
+When `TRACE_PATH` is set every inbound WebSocket action, connect/disconnect
+and `/verify` call is appended to a compact binary trace. Only timing,
+action kind, anonymized device ids and small numeric arguments are stored,
+never message text or images.
+
+File layout: `MAGIC` followed by fixed-size little-endian records
+(`RECORD` struct): ms offset (uint32), kind (uint8), device (uint64),
+peer (uint64), arg (uint16). Each recorder run starts with a SEGMENT record
+whose `device` field holds the wall-clock start in epoch ms; offsets are
+relative to the start of their segment. A run that lasts longer than
+`ROLL_MS` starts a new segment whose `t_ms` is `ROLL_MS`, so the uint32
+offsets never wrap (`read_trace` adds it back).
+
+CONNECT and VERIFY are recorded before admission control; attempts that were
+refused (1013 / 503) carry the `SHED` flag in `arg`, so a trace taken during a
+spike still contains the load that caused it.
+"""
+import hashlib
+import os
+import secrets
+import struct
+import time
+from typing import Iterator, NamedTuple, Optional
+
+TRACE_PATH = os.getenv("TRACE_PATH")
+
+MAGIC = b"ACTRACE1"
+RECORD = struct.Struct("<IBQQH")
+
+# Record kinds
+OTHER, CONNECT, DISCONNECT, JOIN, LEAVE, MSG, TYPING, NEXT, REPORT, VERIFY = range(10)
+SEGMENT = 255
+ROLL_MS = 1 << 31  # ~24.8 days per segment, well inside uint32
+
+# `arg` flags
+RESUMED = 0x0001  # CONNECT carried a resume token
+SHED = 0x8000  # CONNECT / VERIFY refused by admission control
+ACTION_KINDS = {"join": JOIN, "leave": LEAVE, "msg": MSG, "typing": TYPING, "next": NEXT, "report": REPORT}
+
+# `arg` encoding for join filters
+FILTERS = ("any", "male", "female", "non-binary", "prefer-not-to-say")
+FILTER_CODES = {f: i for i, f in enumerate(FILTERS)}
+
+
+class TraceRecord(NamedTuple):
+    t_ms: int
+    kind: int
+    device: int
+    peer: int
+    arg: int
+
+
+class TraceRecorder:
+    """Append-only writer of anonymized trace records"""
+
+    def __init__(self, path: Optional[str] = TRACE_PATH):
+        self.path = path
+        self.enabled = bool(path)
+        self.records = 0
+        self._fh = None
+        # Per-run key so anonymized ids can't be matched against known device ids
+        self._salt = secrets.token_bytes(16)
+        self._start = time.monotonic()
+
+    def open(self):
+        if not self.enabled or self._fh is not None:
+            return
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        self._fh = open(self.path, "ab", buffering=64 * 1024)
+        if new:
+            self._fh.write(MAGIC)
+        self._start = time.monotonic()
+        self._fh.write(RECORD.pack(0, SEGMENT, int(time.time() * 1000), 0, 0))
+        print(f"[TRACE] Recording to {self.path}")
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def anon(self, device_id: Optional[str]) -> int:
+        if not device_id:
+            return 0
+        digest = hashlib.blake2b(str(device_id).encode(), digest_size=8, key=self._salt).digest()
+        return int.from_bytes(digest, "little")
+
+    def record(self, kind: int, device_id: str, peer_id: Optional[str] = None, arg: int = 0):
+        if self._fh is None:
+            return
+        t_ms = int((time.monotonic() - self._start) * 1000)
+        if t_ms >= ROLL_MS:
+            # Start a new segment before the uint32 offset can wrap
+            self._start += ROLL_MS / 1000
+            t_ms -= ROLL_MS
+            self._fh.write(RECORD.pack(ROLL_MS, SEGMENT, int(time.time() * 1000), 0, 0))
+        self._fh.write(RECORD.pack(t_ms, kind, self.anon(device_id), self.anon(peer_id), min(max(arg, 0), 0xFFFF)))
+        self.records += 1
+
+    def record_action(self, device_id: str, data: dict):
+        """Record an inbound WebSocket action without keeping any of its content"""
+        action = data.get("action")
+        kind = ACTION_KINDS.get(action, OTHER) if isinstance(action, str) else OTHER
+        if kind == JOIN:
+            self.record(kind, device_id, arg=FILTER_CODES.get(data.get("filter", "any"), 0))
+        elif kind == MSG:
+            text = data.get("text")
+            self.record(kind, device_id, arg=len(text) if isinstance(text, str) else 0)
+        elif kind == REPORT:
+            self.record(kind, device_id, peer_id=data.get("reported"))
+        else:
+            self.record(kind, device_id)
+
+
+def read_trace(path: str) -> Iterator[TraceRecord]:
+    """Yield records with `t_ms` made continuous across segments"""
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a trace file")
+        base = 0
+        last = 0
+        while True:
+            chunk = fh.read(RECORD.size)
+            if len(chunk) < RECORD.size:
+                return
+            rec = TraceRecord(*RECORD.unpack(chunk))
+            if rec.kind == SEGMENT:
+                # A new recorder run continues from the last record (downtime is
+                # dropped); a rollover segment continues its run ROLL_MS later
+                base = base + rec.t_ms if rec.t_ms else last
+                continue
+            last = base + rec.t_ms
+            yield rec._replace(t_ms=last)
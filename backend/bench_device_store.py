@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the device store in app/devices.py.
+Compares memory per device of the old dict-of-dicts layout with DeviceStore.
+
+Run from the backend directory:  python bench_device_store.py [devices]
+"""
+import sys
+import time
+import tracemalloc
+
+from app.devices import DeviceStore, GENDER_INDEX, current_day
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+NICKNAMES = ["Anon", "Stranger", "NightOwl", "Blue"]
+GENDERS = list(GENDER_INDEX)
+
+
+def device_ids(n):
+    return [f"{i:08x}-0000-4000-8000-{i:012x}" for i in range(n)]
+
+
+def measure(label, build):
+    ids = device_ids(N)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    state = build(ids)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    print(f"  {label:<28} {used / N:8.1f} bytes/device")
+    return used / N
+
+
+def build_legacy(ids):
+    # Previous layout: devices[...] dict plus request_count[...] dict per device
+    devices, request_count = {}, {}
+    now = time.time()
+    for i, d in enumerate(ids):
+        devices[d] = {
+            "gender": GENDERS[i & 3],
+            "limits": {},
+            "nickname": NICKNAMES[i & 3],
+            "daily_counts": {"date": time.strftime("%Y-%m-%d"), "male": 0, "female": 0, "non-binary": 0, "prefer-not-to-say": 0},
+            "last_join": now,
+        }
+        devices[d]["daily_counts"][GENDERS[i & 3]] += 1
+        request_count[d] = {"count": 1, "timestamp": now}
+    return devices, request_count
+
+
+def build_store(ids):
+    store = DeviceStore(capacity=len(ids))
+    now = time.time()
+    today = current_day()
+    for i, d in enumerate(ids):
+        s = store.ensure(d)
+        s.gender = GENDERS[i & 3]
+        s.nickname = NICKNAMES[i & 3]
+        s.day = today
+        s.counts[i & 3] += 1
+        s.last_join = now
+        s.rate_start = now
+        s.rate_count = 1
+    return store
+
+
+def main():
+    print("=" * 60)
+    print(f"Device store benchmark ({N} devices, device id strings excluded)")
+    print("=" * 60)
+    legacy = measure("legacy dict of dicts", build_legacy)
+    store = measure("DeviceStore (__slots__)", build_store)
+    print(f"\n  saving: {legacy - store:.1f} bytes/device ({(1 - store / legacy) * 100:.0f}%)")
+
+    print("\n[Eviction]")
+    store = DeviceStore(capacity=N // 10)
+    start = time.perf_counter()
+    for d in device_ids(N):
+        store.ensure(d)
+    elapsed = time.perf_counter() - start
+    print(f"  ensure() with LRU eviction: {elapsed / N * 1e6:.2f} us/device, resident={len(store)}, evicted={store.evicted}")
+
+
+if __name__ == "__main__":
+    main()
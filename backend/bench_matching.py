@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Matchmaking benchmark: simulates devices joining, chatting and pressing
+`next` in virtual time, and compares the previous first-compatible policy
+with app/matching.py.
+
+Reports p50/p99 time-to-match, churn (matches ended immediately because the
+peer did not satisfy the user's filter or was a recent partner) and the
+wall-clock cost of picking a partner. Time-to-match runs from a device's
+first join through any churned re-queues until a match that sticks, for both
+sides of that match. The new policy re-runs matching for a queued device when
+a recent partner it skipped becomes eligible, as app/main.py does; a small
+low-traffic run and a two-device check cover recent partners left alone in
+the queues.
+
+Run from the backend directory:  python bench_matching.py [devices] [seconds]
+"""
+import heapq
+import random
+import sys
+import time
+from collections import deque
+
+from app.devices import DeviceState, RECENT_PARTNERS
+from app.matching import pick_partner, relax_deadline, partner_key, accepts
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+DURATION = float(sys.argv[2]) if len(sys.argv) > 2 else 4 * 3600
+CHAT_MEAN_SECONDS = 60.0
+CHURN_COOLDOWN = 5.0  # join cooldown after an immediate `next`
+THINK_SECONDS = (5.0, 15.0)
+OPPOSITE = {"male": "female", "female": "male"}
+LOW_TRAFFIC = 20
+
+
+def make_population(rng, n):
+    population = []
+    for _ in range(n):
+        gender = rng.choices(["male", "female", "non-binary"], weights=[45, 45, 10])[0]
+        r = rng.random()
+        if r < 0.5 or gender not in OPPOSITE:
+            filter_pref = "any"
+        elif r < 0.9:
+            filter_pref = OPPOSITE[gender]
+        else:
+            filter_pref = gender
+        population.append((gender, filter_pref))
+    return population
+
+
+def new_queues():
+    return {"male": [], "female": [], "non-binary": [], "prefer-not-to-say": [], "any": []}
+
+
+def legacy_pick(queues, device_id, me, filter_pref, lookup, now):
+    # Previous policy: first waiter (dict order) whose gender satisfies my filter
+    for key, lst in queues.items():
+        for idx, (other_id, _ws, _t) in enumerate(lst):
+            if other_id != device_id and accepts(filter_pref, lookup(other_id).gender):
+                return key, idx
+    return None
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def simulate(label, pick, remember, n=N):
+    rng = random.Random(42)
+    population = make_population(rng, n)
+    ids = [f"sim-{i:06d}" for i in range(n)]
+    states = {}
+    for d, (gender, _f) in zip(ids, population):
+        states[d] = DeviceState()
+        states[d].gender = gender
+    filters = dict(zip(ids, (f for _g, f in population)))
+    history = {d: deque(maxlen=RECENT_PARTNERS) for d in ids}
+    queues = new_queues()
+    seeking_since = {}  # device -> time it started looking (kept across churned matches)
+    waits, waiter_waits, pick_cost = [], [], []
+    matches = churn_filter = churn_repeat = rematches = 0
+
+    # (time, seq, device, rematch): a join, or a re-match of a queued device
+    events = [(rng.uniform(0, 30), i, d, False) for i, d in enumerate(ids)]
+    heapq.heapify(events)
+    seq = len(events)
+    while events:
+        now, _, d, rematch = heapq.heappop(events)
+        if now > DURATION:
+            break
+        if rematch:
+            entries = queues[filters[d]]
+            idx = next((i for i, e in enumerate(entries) if e[0] == d), None)
+            if idx is None:
+                continue
+            entry = entries.pop(idx)
+        else:
+            seeking_since.setdefault(d, now)
+        start = time.perf_counter()
+        found = pick(queues, d, states[d], filters[d], states.get, now)
+        pick_cost.append(time.perf_counter() - start)
+        if not found:
+            if rematch:
+                queues[filters[d]].insert(idx, entry)
+            else:
+                queues[filters[d]].append((d, None, now))
+            if remember:
+                retry_at = relax_deadline(queues, d, states[d], filters[d], states.get)
+                if retry_at is not None:
+                    seq += 1
+                    heapq.heappush(events, (max(now, retry_at), seq, d, True))
+            continue
+        rematches += rematch
+        key, idx = found
+        other, _ws, _t = queues[key].pop(idx)
+        matches += 1
+        if remember:
+            states[d].remember(partner_key(other))
+            states[other].remember(partner_key(d))
+        bad_filter = not accepts(filters[d], states[other].gender) or not accepts(filters[other], states[d].gender)
+        repeat = other in history[d] or d in history[other]
+        history[d].append(other)
+        history[other].append(d)
+        if bad_filter or repeat:
+            churn_filter += bad_filter
+            churn_repeat += repeat and not bad_filter
+            rejoin = now + CHURN_COOLDOWN
+            t_d = t_o = rejoin
+        else:
+            waits.append(now - seeking_since.pop(d))
+            waits.append(now - seeking_since.pop(other))
+            waiter_waits.append(waits[-1])
+            end = now + rng.expovariate(1 / CHAT_MEAN_SECONDS)
+            t_d = end + rng.uniform(*THINK_SECONDS)
+            t_o = end + rng.uniform(*THINK_SECONDS)
+        seq += 2
+        heapq.heappush(events, (t_d, seq - 1, d, False))
+        heapq.heappush(events, (t_o, seq, other, False))
+
+    churn = churn_filter + churn_repeat
+    print(f"\n[{label}]")
+    print(f"  matches:            {matches} ({rematches} from scheduled re-matches)")
+    print(f"  time-to-match p50:  {percentile(waits, 0.5):8.2f} s")
+    print(f"  time-to-match p99:  {percentile(waits, 0.99):8.2f} s")
+    print(f"  time-to-match mean: {sum(waits) / max(1, len(waits)):8.2f} s")
+    print(f"  waiter side p50/p99: {percentile(waiter_waits, 0.5):7.2f} s / {percentile(waiter_waits, 0.99):.2f} s")
+    print(f"  churn rate:         {churn / max(1, matches) * 100:7.2f} %  "
+          f"(filter mismatch {churn_filter}, recent partner {churn_repeat})")
+    print(f"  pick cost:          {sum(pick_cost) / max(1, len(pick_cost)) * 1e6:8.2f} us avg, "
+          f"p99 {percentile(pick_cost, 0.99) * 1e6:.2f} us")
+    stranded = max((now - t for e in queues.values() for _d, _ws, t in e), default=0.0)
+    print(f"  longest still queued at end: {stranded:.2f} s")
+
+
+def check_recent_pair():
+    """Two recent partners alone in the queues must be paired once MATCH_RELAX_SECONDS passes"""
+    states = {"a": DeviceState(), "b": DeviceState()}
+    states["a"].gender, states["b"].gender = "male", "female"
+    states["a"].remember(partner_key("b"))
+    states["b"].remember(partner_key("a"))
+    queues = new_queues()
+    queues["any"].append(("a", None, 0.0))
+    skipped = pick_partner(queues, "b", states["b"], "any", states.get, 1.0) is None
+    retry_at = relax_deadline(queues, "b", states["b"], "any", states.get)
+    found = retry_at is not None and pick_partner(queues, "b", states["b"], "any", states.get, retry_at)
+    ok = skipped and bool(found)
+    print("\n[recent partners alone in the queues]")
+    print(f"  skipped on join: {skipped}, re-match at t={retry_at}s paired them: {bool(found)}  "
+          f"-> {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def main():
+    print("=" * 60)
+    print(f"Matchmaking benchmark ({N} devices, {DURATION / 3600:.1f}h simulated)")
+    print("=" * 60)
+    simulate("legacy first-compatible", legacy_pick, remember=False)
+    simulate("wait-aware, bidirectional, recent-partner ring", pick_partner, remember=True)
+    simulate(f"low traffic ({LOW_TRAFFIC} devices), legacy", legacy_pick, remember=False, n=LOW_TRAFFIC)
+    simulate(f"low traffic ({LOW_TRAFFIC} devices), new policy", pick_partner, remember=True, n=LOW_TRAFFIC)
+    return 0 if check_recent_pair() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
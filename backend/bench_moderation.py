@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the report tracker in app/moderation.py.
+Measures memory per tracked device and the cost of recording a report.
+
+Run from the backend directory:  python bench_moderation.py [devices]
+"""
+import sys
+import time
+import tracemalloc
+
+from app.moderation import ReportTracker, REPORT_BUCKETS
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+REPORTS_PER_TARGET = 3
+
+
+def target_ids(n):
+    return [f"device-{i:012d}" for i in range(n)]
+
+
+def measure(label, build):
+    ids = target_ids(N)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    state = build(ids)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    print(f"  {label:<34} {used / N:8.1f} bytes/device")
+    return state
+
+
+def build_tracker(ids):
+    tracker = ReportTracker()
+    now = time.time()
+    for t in ids:
+        for r in range(REPORTS_PER_TARGET):
+            tracker.record(f"reporter-{r}", t, now + r * 60)
+    return tracker
+
+
+def build_legacy_counter(ids):
+    # Previous layout: device_id -> total reports (no window, no dedup)
+    report_count = {}
+    for t in ids:
+        for _ in range(REPORTS_PER_TARGET):
+            report_count[t] = report_count.get(t, 0) + 1
+    return report_count
+
+
+def main():
+    print("=" * 60)
+    print(f"Report tracker benchmark ({N} targets, {REPORTS_PER_TARGET} reporters each, {REPORT_BUCKETS} buckets)")
+    print("=" * 60)
+    print("\n[Memory] (device id strings excluded)")
+    measure("legacy report_count dict", build_legacy_counter)
+    tracker = measure("sliding-window ReportTracker", build_tracker)
+
+    print("\n[Throughput]")
+    now = time.time()
+    ids = target_ids(N)
+    start = time.perf_counter()
+    for i, t in enumerate(ids):
+        tracker.record(f"late-reporter-{i & 7}", t, now + 3600)
+    elapsed = time.perf_counter() - start
+    print(f"  record(): {elapsed / N * 1e6:.2f} us/report")
+
+    start = time.perf_counter()
+    for t in ids:
+        tracker.count(t, now + 3600)
+    elapsed = time.perf_counter() - start
+    print(f"  count():  {elapsed / N * 1e6:.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    main()
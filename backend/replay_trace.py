@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Replay a traffic trace recorded with TRACE_PATH against a running backend.
+
+Drives every recorded device with the same schedule of connects, actions and
+/verify calls, at 1x or accelerated speed, then prints a summary that can be
+diffed between two server builds.
+
+    python replay_trace.py trace.bin --url http://localhost:8000 --speed 10
+
+Device ids are replayed as `replay-<anon id>`. Message text is synthetic
+(same length as recorded). /verify uploads a synthetic image seeded by the
+device, so start the server with PYTHONHASHSEED=0 for identical genders
+across runs.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from io import BytesIO
+
+import httpx
+import websockets
+
+from app.trace import (
+    read_trace, FILTERS, CONNECT, DISCONNECT, JOIN, LEAVE, MSG, TYPING, NEXT, REPORT, VERIFY, RESUMED, SHED,
+)
+
+ACTION_NAMES = {JOIN: "join", LEAVE: "leave", MSG: "msg", TYPING: "typing", NEXT: "next", REPORT: "report"}
+
+
+def replay_id(anon: int) -> str:
+    return f"replay-{anon:016x}"
+
+
+def synthetic_image(anon: int) -> bytes:
+    rng = random.Random(anon)
+    try:
+        from PIL import Image
+        img = Image.frombytes("L", (128, 128), rng.randbytes(128 * 128))
+        buf = BytesIO()
+        img.save(buf, format="PNG")
+        return buf.getvalue()
+    except ImportError:
+        return rng.randbytes(16 * 1024)
+
+
+class Replay:
+    def __init__(self, url: str, speed: float):
+        self.http_url = url.rstrip("/")
+        self.ws_url = self.http_url.replace("http", "ws", 1)
+        self.speed = speed
+        self.start = 0.0
+        self.sent = Counter()
+        self.received = Counter()
+        self.errors = Counter()
+        self.slip_ms = []
+
+    async def wait_until(self, t_ms: int):
+        target = self.start + t_ms / 1000 / self.speed
+        delay = target - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.slip_ms.append(max(0.0, (time.perf_counter() - target) * 1000))
+
+    async def drain(self, ws, state: dict):
+        try:
+            async for raw in ws:
+                msg = json.loads(raw)
+                self.received[msg.get("type", "?")] += 1
+                if msg.get("type") == "session":
+                    state["token"] = msg.get("resume_token")
+        except websockets.ConnectionClosed as e:
+            if e.rcvd and e.rcvd.code == 1013:
+                self.errors["ws_refused"] += 1
+
+    async def device(self, client: httpx.AsyncClient, anon: int, events):
+        dev = replay_id(anon)
+        state = {"token": None}
+        ws = None
+        readers = []
+        for ev in events:
+            await self.wait_until(ev.t_ms)
+            try:
+                if ev.kind == CONNECT and ev.arg & SHED:
+                    # Refused when recorded: replay the attempt's load without keeping the socket
+                    probe = await websockets.connect(f"{self.ws_url}/ws?device_id={dev}")
+                    await probe.close()
+                    self.sent["connect_shed"] += 1
+                elif ev.kind == CONNECT:
+                    if ws is not None:
+                        await ws.close()
+                    url = f"{self.ws_url}/ws?device_id={dev}"
+                    if ev.arg & RESUMED and state["token"]:
+                        url += f"&resume_token={state['token']}"
+                    ws = await websockets.connect(url)
+                    readers.append(asyncio.create_task(self.drain(ws, state)))
+                    self.sent["connect"] += 1
+                elif ev.kind == DISCONNECT:
+                    if ws is not None:
+                        await ws.close()
+                        ws = None
+                    self.sent["disconnect"] += 1
+                elif ev.kind == VERIFY:
+                    r = await client.post(
+                        f"{self.http_url}/verify",
+                        params={"device_id": dev},
+                        files={"file": ("replay.png", synthetic_image(anon), "image/png")},
+                    )
+                    self.sent["verify_shed" if ev.arg & SHED else "verify"] += 1
+                    self.received[f"verify_{r.status_code}"] += 1
+                elif ws is None:
+                    self.errors["action_without_socket"] += 1
+                else:
+                    payload = {"action": ACTION_NAMES.get(ev.kind, "other")}
+                    if ev.kind == JOIN:
+                        payload.update(filter=FILTERS[ev.arg] if ev.arg < len(FILTERS) else "any", nickname="replay")
+                    elif ev.kind == MSG:
+                        payload["text"] = "x" * max(1, ev.arg)
+                    elif ev.kind == REPORT:
+                        payload.update(reported=replay_id(ev.peer), reason="replay")
+                    await ws.send(json.dumps(payload))
+                    self.sent[payload["action"]] += 1
+            except (websockets.WebSocketException, OSError, httpx.HTTPError) as e:
+                self.errors[type(e).__name__] += 1
+                ws = None
+        if ws is not None:
+            await ws.close()
+        if readers:
+            await asyncio.gather(*readers, return_exceptions=True)
+
+    async def run(self, records):
+        by_device = defaultdict(list)
+        for rec in records:
+            by_device[rec.device].append(rec)
+        self.start = time.perf_counter()
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            await asyncio.gather(*(self.device(client, anon, evs) for anon, evs in by_device.items()))
+        return len(by_device), time.perf_counter() - self.start
+
+    def summary(self, devices: int, elapsed: float) -> dict:
+        slip = sorted(self.slip_ms)
+        pct = lambda p: round(slip[min(len(slip) - 1, int(p * len(slip)))], 2) if slip else 0.0
+        return {
+            "devices": devices,
+            "elapsed_s": round(elapsed, 3),
+            "speed": self.speed,
+            "sent": dict(self.sent),
+            "received": dict(self.received),
+            "errors": dict(self.errors),
+            "schedule_slip_ms": {"p50": pct(0.5), "p99": pct(0.99), "max": pct(1.0)},
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed multiplier (default 1x)")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N records")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    records = list(read_trace(args.trace))
+    if args.limit:
+        records = records[: args.limit]
+    if not records:
+        print("Trace is empty")
+        return 1
+
+    replay = Replay(args.url, args.speed)
+    devices, elapsed = asyncio.run(replay.run(records))
+    summary = replay.summary(devices, elapsed)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+    print("=" * 60)
+    print(f"Replayed {len(records)} records for {devices} devices in {elapsed:.2f}s at {args.speed}x")
+    print("=" * 60)
+    for key in ("sent", "received", "errors", "schedule_slip_ms"):
+        print(f"\n[{key}]")
+        for name, value in sorted(summary[key].items()):
+            print(f"  {name:<24} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())